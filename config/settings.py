@@ -81,6 +81,28 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# Used to memoize generated Mermaid output. Local memory is fine for the
+# single-process dev server; point this at Redis/Memcached when running
+# multiple workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Keep sessions in the cache instead of the database. The toggle endpoints
+# read and write the session on every click, and the default DB backend
+# costs a SELECT+UPDATE on django_session per request.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
+
+# The session now holds only a handful of short strings (schema cache key,
+# connection string), so the stdlib JSON serializer is not a bottleneck;
+# revisit (e.g. orjson) only if large payloads ever move back into it.
+SESSION_SERIALIZER = 'django.contrib.sessions.serializers.JSONSerializer'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -1,14 +1,38 @@
 """Utilities for parsing database connections and extracting schema information."""
+import functools
+import threading
+import weakref
+
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 from typing import Dict, List, Tuple
 from django.conf import settings
 
+# Process-wide connection pools, one per connection string. Reusing warm
+# connections avoids paying TLS+auth setup on every schema load.
+_POOLS: Dict[str, ThreadedConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def _get_pool(connection_string: str) -> ThreadedConnectionPool:
+    """Get or lazily create the connection pool for a connection string."""
+    with _POOLS_LOCK:
+        pool = _POOLS.get(connection_string)
+        if pool is None:
+            pool = ThreadedConnectionPool(minconn=1, maxconn=5, dsn=connection_string)
+            _POOLS[connection_string] = pool
+        return pool
 
+
+@functools.lru_cache(maxsize=1)
 def parse_connections() -> Dict[str, str]:
     """Parse POSTGRES_CONNECTIONS environment variable.
 
     Format: "name1=postgres://...,name2=postgres://..."
     Returns: {"name1": "postgres://...", "name2": "postgres://..."}
+
+    The value comes from the environment and cannot change at runtime, so
+    the parsed dict is memoized rather than rebuilt on every index render.
     """
     connections = {}
     if not settings.POSTGRES_CONNECTIONS:
@@ -28,25 +52,84 @@ def get_database_schema(connection_string: str) -> Dict:
     Returns a dictionary with tables, columns, and relationships.
     Optimized to use batch queries instead of per-table queries.
     """
-    conn = psycopg2.connect(connection_string)
-    cursor = conn.cursor()
+    pool = _get_pool(connection_string)
+    conn = pool.getconn()
+
+    try:
+        schema = _extract_schema(conn)
+        # Commit the read-only transaction so session-level state (the
+        # prepared statement) survives the pool's rollback on putconn.
+        # Only mark the connection prepared once that commit succeeds: if
+        # extraction fails first, the rollback deallocates the statement
+        # and the connection must be re-prepared on its next use.
+        conn.commit()
+        _PREPARED_CONNS.add(conn)
+        return schema
+    finally:
+        pool.putconn(conn)
+
+
+# Above this many schema-wide foreign keys, the diagram views ask Postgres
+# for just the relationships between selected tables instead of filtering
+# the full list in Python.
+RELATIONSHIP_PUSHDOWN_THRESHOLD = 5000
+
+
+# Pooled connections on which the table-list statement has been PREPAREd.
+# Prepared plans are per-session, so they survive across load_schema calls
+# on the same pooled connection.
+_PREPARED_CONNS = weakref.WeakSet()
+
+_TABLES_SQL = """
+    SELECT n.nspname, c.relname
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind = 'r'
+        AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+    ORDER BY n.nspname, c.relname
+"""
+
+
+def _catalog_rows(conn, name: str, query: str):
+    """Stream rows of a catalog query through a named (server-side) cursor.
+
+    Streaming in batches keeps peak memory at O(itersize) instead of
+    materializing every row client-side, which matters for databases with
+    tens of thousands of columns.
+    """
+    cursor = conn.cursor(name=name)
+    cursor.itersize = 2000
+    try:
+        cursor.execute(query)
+        yield from cursor
+    finally:
+        cursor.close()
+
 
+def _extract_schema(conn) -> Dict:
+    """Run the catalog queries on an open connection and build the schema dict."""
     schema = {
         'tables': {},
-        'relationships': []
+        'relationships': [],
+        'rels_by_table': {}
     }
 
-    # Get all tables from all schemas (excluding system schemas)
-    cursor.execute("""
-        SELECT table_schema, table_name
-        FROM information_schema.tables
-        WHERE table_schema NOT IN ('pg_catalog', 'information_schema')
-        AND table_type = 'BASE TABLE'
-        ORDER BY table_schema, table_name
-    """)
-
-    # Initialize all tables
-    tables = [(row[0], row[1]) for row in cursor.fetchall()]
+    # Get all tables from all schemas (excluding system schemas). Queries go
+    # straight to pg_catalog: the information_schema views join many catalog
+    # tables and are far slower on databases with lots of objects.
+    # The table list is small and is materialized anyway (the schema count
+    # decides name qualification below), so run it on a plain client-side
+    # cursor and skip the DECLARE/FETCH/CLOSE roundtrips a named cursor
+    # would add on top of the query itself. The statement is PREPAREd once
+    # per pooled connection so repeated schema loads skip planning.
+    cursor = conn.cursor()
+    try:
+        if conn not in _PREPARED_CONNS:
+            cursor.execute("PREPARE erd_tables AS " + _TABLES_SQL)
+        cursor.execute("EXECUTE erd_tables")
+        tables = cursor.fetchall()
+    finally:
+        cursor.close()
 
     # Check if there's only one schema
     unique_schemas = set(row[0] for row in tables)
@@ -60,105 +143,154 @@ def get_database_schema(connection_string: str) -> Dict:
         qualified_name = qualify(table_schema, table_name)
         schema['tables'][qualified_name] = {
             'columns': [],
+            'columns_by_name': {},
             'primary_keys': [],
             'foreign_keys': [],
             'unique_keys': []
         }
 
-    # Batch query: Get all columns for all tables at once
-    cursor.execute("""
-        SELECT table_schema, table_name, column_name, data_type, character_maximum_length
-        FROM information_schema.columns
-        WHERE table_schema NOT IN ('pg_catalog', 'information_schema')
-        ORDER BY table_schema, table_name, ordinal_position
+    # Batch query: Get all columns for all tables at once. format_type
+    # renders the full type including length/precision modifiers.
+    columns = _catalog_rows(conn, 'erd_columns', """
+        SELECT n.nspname, c.relname, a.attname, format_type(a.atttypid, a.atttypmod)
+        FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE a.attnum > 0
+            AND NOT a.attisdropped
+            AND c.relkind = 'r'
+            AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+        ORDER BY n.nspname, c.relname, a.attnum
     """)
 
-    for table_schema, table_name, col_name, data_type, max_length in cursor.fetchall():
+    for table_schema, table_name, col_name, type_str in columns:
         qualified_name = qualify(table_schema, table_name)
         if qualified_name in schema['tables']:
-            type_str = data_type
-            if max_length:
-                type_str = f"{data_type}({max_length})"
-
-            schema['tables'][qualified_name]['columns'].append({
+            table = schema['tables'][qualified_name]
+            # The list keeps template iteration order; the dict gives the
+            # renderer O(1) lookup by column name
+            table['columns'].append({
                 'name': col_name,
                 'type': type_str
             })
+            table['columns_by_name'][col_name] = {'type': type_str}
 
-    # Batch query: Get all primary keys at once
-    cursor.execute("""
-        SELECT tc.table_schema, tc.table_name, kcu.column_name
-        FROM information_schema.table_constraints tc
-        JOIN information_schema.key_column_usage kcu
-            ON tc.constraint_name = kcu.constraint_name
-            AND tc.table_schema = kcu.table_schema
-        WHERE tc.constraint_type = 'PRIMARY KEY'
-            AND tc.table_schema NOT IN ('pg_catalog', 'information_schema')
-    """)
-
-    for table_schema, table_name, col_name in cursor.fetchall():
-        qualified_name = qualify(table_schema, table_name)
-        if qualified_name in schema['tables']:
-            schema['tables'][qualified_name]['primary_keys'].append(col_name)
-
-    # Batch query: Get all foreign keys at once
-    cursor.execute("""
+    # Batch query: Get all primary key, foreign key, and unique constraints in
+    # a single pg_constraint scan, tagged by contype, and dispatch in Python.
+    # unnest pairs up referencing and referenced column numbers positionally
+    # for multi-column keys; the referenced side is NULL for PK/UK rows.
+    constraints = _catalog_rows(conn, 'erd_constraints', """
         SELECT
-            tc.table_schema,
-            tc.table_name,
-            kcu.column_name,
-            ccu.table_schema AS foreign_table_schema,
-            ccu.table_name AS foreign_table_name,
-            ccu.column_name AS foreign_column_name
-        FROM information_schema.table_constraints AS tc
-        JOIN information_schema.key_column_usage AS kcu
-            ON tc.constraint_name = kcu.constraint_name
-            AND tc.table_schema = kcu.table_schema
-        JOIN information_schema.constraint_column_usage AS ccu
-            ON ccu.constraint_name = tc.constraint_name
-        WHERE tc.constraint_type = 'FOREIGN KEY'
-            AND tc.table_schema NOT IN ('pg_catalog', 'information_schema')
+            con.contype,
+            n.nspname,
+            c.relname,
+            a.attname,
+            fn.nspname AS foreign_table_schema,
+            fc.relname AS foreign_table_name,
+            fa.attname AS foreign_column_name
+        FROM pg_constraint con
+        JOIN pg_class c ON c.oid = con.conrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        CROSS JOIN LATERAL unnest(con.conkey) WITH ORDINALITY AS k(attnum, ord)
+        JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+        LEFT JOIN pg_class fc ON fc.oid = con.confrelid
+        LEFT JOIN pg_namespace fn ON fn.oid = fc.relnamespace
+        LEFT JOIN LATERAL unnest(con.confkey) WITH ORDINALITY AS fk(attnum, ord)
+            ON fk.ord = k.ord
+        LEFT JOIN pg_attribute fa ON fa.attrelid = con.confrelid AND fa.attnum = fk.attnum
+        WHERE con.contype IN ('p', 'f', 'u')
+            AND n.nspname NOT IN ('pg_catalog', 'information_schema')
     """)
 
-    for table_schema, table_name, col_name, foreign_schema, foreign_table, foreign_column in cursor.fetchall():
+    for contype, table_schema, table_name, col_name, foreign_schema, foreign_table, foreign_column in constraints:
         qualified_name = qualify(table_schema, table_name)
-        foreign_qualified = qualify(foreign_schema, foreign_table)
+        if qualified_name not in schema['tables']:
+            continue
 
-        if qualified_name in schema['tables']:
+        if contype == 'p':
+            schema['tables'][qualified_name]['primary_keys'].append(col_name)
+        elif contype == 'u':
+            schema['tables'][qualified_name]['unique_keys'].append(col_name)
+        elif contype == 'f':
+            foreign_qualified = qualify(foreign_schema, foreign_table)
             schema['tables'][qualified_name]['foreign_keys'].append({
                 'column': col_name,
                 'foreign_table': foreign_qualified,
                 'foreign_column': foreign_column
             })
 
-            # Add to relationships
-            schema['relationships'].append({
+            # Add to relationships, indexed by both endpoints so diagram
+            # rendering only has to look at tables that are selected
+            rel = {
                 'from_table': qualified_name,
                 'from_column': col_name,
                 'to_table': foreign_qualified,
                 'to_column': foreign_column
-            })
+            }
+            schema['relationships'].append(rel)
+            schema['rels_by_table'].setdefault(qualified_name, []).append(rel)
+            if foreign_qualified != qualified_name:
+                schema['rels_by_table'].setdefault(foreign_qualified, []).append(rel)
 
-    # Batch query: Get all unique constraints at once
-    cursor.execute("""
-        SELECT tc.table_schema, tc.table_name, kcu.column_name
-        FROM information_schema.table_constraints tc
-        JOIN information_schema.key_column_usage kcu
-            ON tc.constraint_name = kcu.constraint_name
-            AND tc.table_schema = kcu.table_schema
-        WHERE tc.constraint_type = 'UNIQUE'
-            AND tc.table_schema NOT IN ('pg_catalog', 'information_schema')
-    """)
+    return schema
 
-    for table_schema, table_name, col_name in cursor.fetchall():
-        qualified_name = qualify(table_schema, table_name)
-        if qualified_name in schema['tables']:
-            schema['tables'][qualified_name]['unique_keys'].append(col_name)
 
-    cursor.close()
-    conn.close()
+def fetch_relationships_between(connection_string: str, tables: List[str]) -> List[Dict]:
+    """Fetch foreign-key relationships between the given tables from Postgres.
 
-    return schema
+    Table names are accepted in either qualified (schema.table) or bare form,
+    matching whatever get_database_schema produced. Letting the database
+    filter scales to schemas with tens of thousands of foreign keys without
+    walking them all in Python.
+    """
+    names = sorted(tables)
+    pool = _get_pool(connection_string)
+    conn = pool.getconn()
+
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT
+                    n.nspname,
+                    c.relname,
+                    a.attname,
+                    fn.nspname AS foreign_table_schema,
+                    fc.relname AS foreign_table_name,
+                    fa.attname AS foreign_column_name
+                FROM pg_constraint con
+                JOIN pg_class c ON c.oid = con.conrelid
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                JOIN pg_class fc ON fc.oid = con.confrelid
+                JOIN pg_namespace fn ON fn.oid = fc.relnamespace
+                CROSS JOIN LATERAL unnest(con.conkey, con.confkey) AS k(attnum, fattnum)
+                JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+                JOIN pg_attribute fa ON fa.attrelid = con.confrelid AND fa.attnum = k.fattnum
+                WHERE con.contype = 'f'
+                    AND (n.nspname || '.' || c.relname = ANY(%(names)s)
+                         OR c.relname = ANY(%(names)s))
+                    AND (fn.nspname || '.' || fc.relname = ANY(%(names)s)
+                         OR fc.relname = ANY(%(names)s))
+            """, {'names': names})
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        conn.commit()
+    finally:
+        pool.putconn(conn)
+
+    wanted = set(tables)
+    relationships = []
+    for table_schema, table_name, col_name, foreign_schema, foreign_table, foreign_column in rows:
+        qualified = f"{table_schema}.{table_name}"
+        foreign_qualified = f"{foreign_schema}.{foreign_table}"
+        relationships.append({
+            'from_table': qualified if qualified in wanted else table_name,
+            'from_column': col_name,
+            'to_table': foreign_qualified if foreign_qualified in wanted else foreign_table,
+            'to_column': foreign_column
+        })
+    return relationships
 
 
 def generate_mermaid(selected_tables: Dict[str, List[str]], schema: Dict) -> str:
@@ -171,65 +303,94 @@ def generate_mermaid(selected_tables: Dict[str, List[str]], schema: Dict) -> str
     Returns:
         Mermaid ERD syntax string
     """
-    lines = ["erDiagram"]
+    return "\n".join(iter_mermaid(selected_tables, schema))
 
-    # Helper function to convert schema.table to valid Mermaid identifier
-    def mermaid_name(table_name: str) -> str:
-        """Replace dots with underscores for Mermaid compatibility."""
-        return table_name.replace('.', '_')
+
+def iter_mermaid(selected_tables: Dict[str, List[str]], schema: Dict):
+    """Yield Mermaid ERD lines for selected tables and columns.
+
+    Generating line by line keeps peak memory at O(one line) and lets
+    downloads start streaming before the whole diagram is built;
+    generate_mermaid joins the lines for callers that need the full string.
+    """
+    yield "erDiagram"
 
     # Generate table definitions
     for table_name, columns in selected_tables.items():
         if not columns:
             continue
+        yield from iter_table_block(table_name, columns, schema.get('tables', {}).get(table_name, {}))
+
+    yield from iter_relationships(selected_tables, schema)
+
 
-        table_info = schema['tables'].get(table_name, {})
-        primary_keys = set(table_info.get('primary_keys', []))
-        foreign_keys = set(fk['column'] for fk in table_info.get('foreign_keys', []))
-        unique_keys = set(table_info.get('unique_keys', []))
-
-        mermaid_table_name = mermaid_name(table_name)
-        lines.append(f"    {mermaid_table_name} {{")
-
-        for col in columns:
-            # Find column type
-            col_type = "string"
-            for col_info in table_info.get('columns', []):
-                if col_info['name'] == col:
-                    col_type = col_info['type']
-                    break
-
-            # Replace spaces with underscores for Mermaid compatibility
-            col_type = col_type.replace(' ', '_')
-
-            # Determine column markers (use sets to avoid duplicates)
-            markers = []
-            if col in primary_keys:
-                markers.append("PK")
-            if col in foreign_keys:
-                markers.append("FK")
-            if col in unique_keys and col not in primary_keys:
-                markers.append("UK")
-
-            marker_str = ",".join(markers)
-            if marker_str:
-                lines.append(f"        {col_type} {col} {marker_str}")
-            else:
-                lines.append(f"        {col_type} {col}")
-
-        lines.append("    }")
-
-    # Generate relationships
-    for rel in schema.get('relationships', []):
+def _mermaid_name(table_name: str) -> str:
+    """Replace dots with underscores for Mermaid compatibility."""
+    return table_name.replace('.', '_')
+
+
+def iter_table_block(table_name: str, columns: List[str], table_info: Dict):
+    """Yield the Mermaid block for a single table's selected columns.
+
+    Split out from iter_mermaid so callers can render (and cache) one
+    table's block at a time.
+    """
+    # Column types come from the stored by-name dict; rebuild it from the
+    # column list only for schema dicts cached before the dict existed
+    columns_by_name = table_info.get('columns_by_name')
+    if columns_by_name is None:
+        columns_by_name = {ci['name']: ci for ci in table_info.get('columns', [])}
+    primary_keys = set(table_info.get('primary_keys', []))
+    foreign_keys = set(fk['column'] for fk in table_info.get('foreign_keys', []))
+    unique_keys = set(table_info.get('unique_keys', []))
+
+    yield f"    {_mermaid_name(table_name)} {{"
+
+    for col in columns:
+        # Replace spaces with underscores for Mermaid compatibility
+        col_type = columns_by_name.get(col, {}).get('type', "string").replace(' ', '_')
+
+        # Determine column markers without building a transient list;
+        # this loop is the hottest part of rendering wide selections
+        markers = (
+            ("PK," if col in primary_keys else "")
+            + ("FK," if col in foreign_keys else "")
+            + ("UK" if col in unique_keys and col not in primary_keys else "")
+        ).rstrip(',')
+
+        yield f"        {col_type} {col} {markers}".rstrip()
+
+    yield "    }"
+
+
+def iter_relationships(selected_tables: Dict[str, List[str]], schema: Dict):
+    """Yield Mermaid relationship lines between selected tables."""
+    # Walk only relationships touching selected tables via the per-table
+    # index; fall back to the flat list for schema dicts built before the
+    # index existed.
+    rels_by_table = schema.get('rels_by_table')
+    if rels_by_table is not None:
+        candidates = []
+        seen = set()
+        for table_name in selected_tables:
+            for rel in rels_by_table.get(table_name, []):
+                rel_key = (rel['from_table'], rel['from_column'],
+                           rel['to_table'], rel['to_column'])
+                if rel_key not in seen:
+                    seen.add(rel_key)
+                    candidates.append(rel)
+    else:
+        candidates = schema.get('relationships', [])
+
+    for rel in candidates:
         from_table = rel['from_table']
         to_table = rel['to_table']
 
         # Only include relationships where both tables are selected
         if from_table in selected_tables and to_table in selected_tables:
             # Convert to Mermaid-compatible names
-            mermaid_from = mermaid_name(from_table)
-            mermaid_to = mermaid_name(to_table)
+            mermaid_from = _mermaid_name(from_table)
+            mermaid_to = _mermaid_name(to_table)
             # Determine cardinality (simplified: one-to-many)
-            lines.append(f'    {mermaid_to} ||--o{{ {mermaid_from} : "has"')
+            yield f'    {mermaid_to} ||--o{{ {mermaid_from} : "has"'
 
-    return "\n".join(lines)
@@ -1,10 +1,157 @@
 """Views for the ERD diagram builder."""
+from django.core.cache import cache
 from django.shortcuts import render
-from django.http import JsonResponse, HttpResponse
+from django.http import (
+    JsonResponse,
+    HttpResponse,
+    HttpResponseNotModified,
+    StreamingHttpResponse,
+)
 from django.views.decorators.http import require_http_methods
+import hashlib
+import itertools
 import json
 
-from .utils import parse_connections, get_database_schema, generate_mermaid
+from .utils import (
+    RELATIONSHIP_PUSHDOWN_THRESHOLD,
+    fetch_relationships_between,
+    parse_connections,
+    get_database_schema,
+    iter_mermaid,
+    iter_relationships,
+    iter_table_block,
+)
+
+# How long generated Mermaid output stays cached (seconds)
+MERMAID_CACHE_TIMEOUT = 300
+
+# How long extracted database schemas stay cached (seconds)
+SCHEMA_CACHE_TIMEOUT = 3600
+
+
+def _schema_cache_key(connection_string):
+    """Cache key for the extracted schema of a database connection."""
+    return 'schema:' + hashlib.blake2b(connection_string.encode(), digest_size=16).hexdigest()
+
+
+def _get_schema(request):
+    """Fetch the cached schema for this session, re-extracting it on a miss.
+
+    The schema and the selection live in separate cache entries with
+    independent lifetimes, so the schema can get evicted while a selection
+    still exists. Rebuild it from the session's connection string in that
+    case instead of silently rendering from nothing; returns {} only when
+    there is no connection to rebuild from or extraction fails.
+    """
+    schema_key = request.session.get('schema_key')
+    if not schema_key:
+        return {}
+
+    schema = cache.get(schema_key)
+    if schema is None:
+        connection_string = request.session.get('connection_string', '')
+        if not connection_string:
+            return {}
+        try:
+            schema = get_database_schema(connection_string)
+        except Exception:
+            return {}
+        cache.set(schema_key, schema, SCHEMA_CACHE_TIMEOUT)
+    return schema
+
+
+def _selection_cache_key(request):
+    """Cache key for this session's table/column selection."""
+    if request.session.session_key is None:
+        request.session.save()
+    return 'sel:' + request.session.session_key
+
+
+def _get_selected_tables(request):
+    """Current selection for this session, as a dict of table -> column list."""
+    return cache.get(_selection_cache_key(request)) or {}
+
+
+def _set_selected_tables(request, selected_tables):
+    """Persist the selection in its own cache entry, outside the session."""
+    cache.set(_selection_cache_key(request), selected_tables, SCHEMA_CACHE_TIMEOUT)
+
+
+def _selection_etag(selected_tables):
+    """ETag for the current selection state; identical state, identical tag."""
+    payload = json.dumps(selected_tables, sort_keys=True).encode()
+    return '"' + hashlib.blake2b(payload, digest_size=8).hexdigest() + '"'
+
+
+def _pushdown_relationships(request, selected_tables, schema):
+    """Swap in DB-filtered relationships when the schema's FK count is huge.
+
+    Below the threshold the in-memory rels_by_table index is cheap enough;
+    above it, ask Postgres for just the foreign keys between the selected
+    tables and cache the result per selection.
+    """
+    if len(schema.get('relationships', [])) <= RELATIONSHIP_PUSHDOWN_THRESHOLD:
+        return schema
+
+    connection_string = request.session.get('connection_string', '')
+    payload = json.dumps(sorted(selected_tables)).encode() + connection_string.encode()
+    key = 'rels:' + hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    relationships = cache.get(key)
+    if relationships is None:
+        relationships = fetch_relationships_between(connection_string, list(selected_tables))
+        cache.set(key, relationships, MERMAID_CACHE_TIMEOUT)
+
+    # Shallow copy with the filtered list so iter_relationships walks only
+    # these rows instead of the schema-wide index
+    schema = dict(schema)
+    schema['relationships'] = relationships
+    schema.pop('rels_by_table', None)
+    return schema
+
+
+def _table_block(table_name, columns, table_info, connection_string):
+    """Rendered Mermaid block for one table, cached by its column selection.
+
+    A toggle only changes one table, so on a whole-diagram cache miss the
+    other tables' blocks can still be reused as-is.
+    """
+    payload = json.dumps([table_name, columns]).encode() + connection_string.encode()
+    key = 'blk:' + hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    block = cache.get(key)
+    if block is None:
+        block = "\n".join(iter_table_block(table_name, columns, table_info))
+        cache.set(key, block, MERMAID_CACHE_TIMEOUT)
+    return block
+
+
+def cached_mermaid(request, selected_tables, schema):
+    """Return Mermaid output for the current selection, cached by selection state.
+
+    Toggling checkboxes back and forth revisits previous selection states, so
+    keying on (selected_tables, connection_string) lets repeated toggles reuse
+    the already-generated string instead of rebuilding the whole diagram. On a
+    miss, the diagram is assembled from per-table cached blocks, so a toggle
+    only renders the table that actually changed.
+    """
+    connection_string = request.session.get('connection_string', '')
+    payload = json.dumps(selected_tables, sort_keys=True).encode() + connection_string.encode()
+    key = 'mmd:' + hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    mermaid_code = cache.get(key)
+    if mermaid_code is None:
+        tables = schema.get('tables', {})
+        lines = ["erDiagram"]
+        for table_name, columns in selected_tables.items():
+            if not columns:
+                continue
+            lines.append(_table_block(table_name, columns, tables.get(table_name, {}),
+                                      connection_string))
+        lines.extend(iter_relationships(selected_tables, schema))
+        mermaid_code = "\n".join(lines)
+        cache.set(key, mermaid_code, MERMAID_CACHE_TIMEOUT)
+    return mermaid_code
 
 
 def index(request):
@@ -27,11 +174,15 @@ def load_schema(request):
 
     try:
         schema = get_database_schema(connection_string)
-        # Store schema in session for later use
-        request.session['schema'] = schema
+        # Keep the (potentially large) schema in the cache and only a small
+        # key in the session, so per-request session (de)serialization stays
+        # O(1) instead of O(schema size)
+        schema_key = _schema_cache_key(connection_string)
+        cache.set(schema_key, schema, SCHEMA_CACHE_TIMEOUT)
+        request.session['schema_key'] = schema_key
         request.session['connection_string'] = connection_string
         # Clear any previously selected tables when loading new schema
-        request.session['selected_tables'] = {}
+        _set_selected_tables(request, {})
 
         return render(request, 'diagram/table_list.html', {
             'tables': schema['tables']
@@ -46,21 +197,25 @@ def toggle_table(request):
     table_name = request.POST.get('table_name')
     is_selected = request.POST.get('selected') == 'true'
 
-    schema = request.session.get('schema', {})
+    schema = _get_schema(request)
     table_info = schema.get('tables', {}).get(table_name, {})
 
-    # Get currently selected tables from session
-    selected_tables = request.session.get('selected_tables', {})
+    # Get currently selected tables
+    selected_tables = _get_selected_tables(request)
 
     if is_selected:
-        # Auto-select primary keys, foreign keys, and unique keys
+        # Auto-select primary keys, foreign keys, and unique keys in a single
+        # deduplicating pass that preserves order
         auto_select = []
-        auto_select.extend(table_info.get('primary_keys', []))
-        auto_select.extend([fk['column'] for fk in table_info.get('foreign_keys', [])])
-        auto_select.extend(table_info.get('unique_keys', []))
-
-        # Remove duplicates while preserving order
-        auto_select = list(dict.fromkeys(auto_select))
+        seen = set()
+        for col in itertools.chain(
+            table_info.get('primary_keys', ()),
+            (fk['column'] for fk in table_info.get('foreign_keys', ())),
+            table_info.get('unique_keys', ()),
+        ):
+            if col not in seen:
+                seen.add(col)
+                auto_select.append(col)
 
         selected_tables[table_name] = auto_select
     else:
@@ -68,14 +223,19 @@ def toggle_table(request):
         if table_name in selected_tables:
             del selected_tables[table_name]
 
-    request.session['selected_tables'] = selected_tables
-    request.session.modified = True
+    _set_selected_tables(request, selected_tables)
+
+    # Identical selection state renders identical output, so rapid repeat
+    # clicks can short-circuit without rendering anything
+    etag = _selection_etag(selected_tables)
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        return HttpResponseNotModified()
 
     # Generate diagram output
     mermaid_code = ""
     if selected_tables:
         try:
-            mermaid_code = generate_mermaid(selected_tables, schema)
+            mermaid_code = cached_mermaid(request, selected_tables, schema)
         except:
             pass
 
@@ -84,7 +244,7 @@ def toggle_table(request):
         # Extract foreign key column names for template
         foreign_key_columns = [fk['column'] for fk in table_info.get('foreign_keys', [])]
 
-        return render(request, 'diagram/toggle_response.html', {
+        response = render(request, 'diagram/toggle_response.html', {
             'table_name': table_name,
             'table_info': table_info,
             'foreign_key_columns': foreign_key_columns,
@@ -94,11 +254,14 @@ def toggle_table(request):
         })
     else:
         # Just return the diagram update
-        return render(request, 'diagram/diagram_only.html', {
+        response = render(request, 'diagram/diagram_only.html', {
             'mermaid_code': mermaid_code,
             'has_selection': bool(selected_tables)
         })
 
+    response['ETag'] = etag
+    return response
+
 
 @require_http_methods(["POST"])
 def toggle_column(request):
@@ -107,47 +270,61 @@ def toggle_column(request):
     column_name = request.POST.get('column_name')
     is_selected = request.POST.get('selected') == 'true'
 
-    schema = request.session.get('schema', {})
-    selected_tables = request.session.get('selected_tables', {})
+    schema = _get_schema(request)
+    selected_tables = _get_selected_tables(request)
 
     if table_name not in selected_tables:
         selected_tables[table_name] = []
 
+    # Only write the selection back when it actually changed; duplicate
+    # clicks shouldn't re-serialize anything.
+    changed = False
     if is_selected:
         if column_name not in selected_tables[table_name]:
             selected_tables[table_name].append(column_name)
+            changed = True
     else:
         if column_name in selected_tables[table_name]:
             selected_tables[table_name].remove(column_name)
+            changed = True
 
-    request.session['selected_tables'] = selected_tables
-    request.session.modified = True
+    if changed:
+        _set_selected_tables(request, selected_tables)
+
+    # Identical selection state renders identical output, so rapid repeat
+    # clicks can short-circuit without rendering anything
+    etag = _selection_etag(selected_tables)
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        return HttpResponseNotModified()
 
     # Generate updated diagram
     mermaid_code = ""
     if selected_tables:
         try:
-            mermaid_code = generate_mermaid(selected_tables, schema)
+            mermaid_code = cached_mermaid(request, selected_tables, schema)
         except:
             pass
 
-    return render(request, 'diagram/diagram_only.html', {
+    response = render(request, 'diagram/diagram_only.html', {
         'mermaid_code': mermaid_code,
         'has_selection': bool(selected_tables)
     })
+    response['ETag'] = etag
+    return response
 
 
 @require_http_methods(["POST"])
 def generate_diagram(request):
     """Generate Mermaid diagram from selected tables and columns."""
-    schema = request.session.get('schema', {})
-    selected_tables = request.session.get('selected_tables', {})
+    schema = _get_schema(request)
+    selected_tables = _get_selected_tables(request)
 
     if not selected_tables:
         return HttpResponse("No tables selected", status=400)
 
     try:
-        mermaid_code = generate_mermaid(selected_tables, schema)
+        schema = _pushdown_relationships(request, selected_tables, schema)
+        mermaid_code = cached_mermaid(request, selected_tables, schema)
         return render(request, 'diagram/mermaid_output.html', {
             'mermaid_code': mermaid_code
         })
@@ -158,16 +335,25 @@ def generate_diagram(request):
 @require_http_methods(["GET"])
 def download_diagram(request):
     """Download Mermaid diagram as .mmd file."""
-    schema = request.session.get('schema', {})
-    selected_tables = request.session.get('selected_tables', {})
+    schema = _get_schema(request)
+    selected_tables = _get_selected_tables(request)
 
     if not selected_tables:
         return HttpResponse("No tables selected", status=400)
 
-    try:
-        mermaid_code = generate_mermaid(selected_tables, schema)
+    # Streaming errors after the 200 is sent would truncate the file, so
+    # refuse up front if the schema is gone and could not be re-extracted
+    if not schema.get('tables'):
+        return HttpResponse("Error generating diagram: schema is no longer available", status=500)
 
-        response = HttpResponse(mermaid_code, content_type='text/plain')
+    try:
+        schema = _pushdown_relationships(request, selected_tables, schema)
+        # Stream line by line so huge exports start downloading immediately
+        # instead of waiting for the whole diagram to be built in memory
+        response = StreamingHttpResponse(
+            (f"{line}\n".encode() for line in iter_mermaid(selected_tables, schema)),
+            content_type='text/plain'
+        )
         response['Content-Disposition'] = 'attachment; filename="erd_diagram.mmd"'
         return response
     except Exception as e: